@@ -0,0 +1,48 @@
+# Copyright (c) 2021-2022 Javad Komijani
+
+"""This module includes numba kernels for evaluation of splines on CPU.
+
+Importing this module raises ImportError if numba is not installed.
+"""
+
+
+import numpy as np
+
+from numba import njit, prange
+
+
+@njit(parallel=True, fastmath=True)
+def rqs_eval(x, kx, ky, kd, out_y, out_dy):
+    """Evaluate the rational quadratic spline and its derivative at `x`.
+
+    The search for segments, the gather of end points of segments, and the
+    evaluation of the rational quadratic function are fused in one parallel
+    loop over all elements of `x`.
+
+    Parameters
+    ----------
+    x : 2D array
+        The input; the first axis runs over rows.
+    kx, ky, kd : 2D arrays
+        Coordinates and derivatives of (already augmented) knots of each row,
+        placed along the second axis.
+    out_y, out_dy : 2D arrays
+        Arrays with the shape of `x` to save the output.
+    """
+    n_rows, n_cols = x.shape
+    segm_len = kx.shape[1] - 1
+    for ij in prange(n_rows * n_cols):
+        i, j = ij // n_cols, ij % n_cols
+        s = np.searchsorted(kx[i], x[i, j])
+        s = min(max(s, 1), segm_len) - 1
+        x0, x1 = kx[i, s], kx[i, s + 1]
+        y0, y1 = ky[i, s], ky[i, s + 1]
+        d0, d1 = kd[i, s], kd[i, s + 1]
+        m = (y1 - y0) / (x1 - x0)  # average slope of the segment
+        c = d1 + d0 - 2 * m
+        theta = (x[i, j] - x0) / (x1 - x0)
+        inv_denom = 1 / (m + c * theta * (1 - theta))
+        out_y[i, j] = y0 + (y1 - y0) * theta * (m * theta + d0 * (1 - theta)) \
+                * inv_denom
+        out_dy[i, j] = m * m * (d0 + 2 * (m - d0) * theta + c * theta * theta) \
+                * inv_denom * inv_denom
@@ -5,6 +5,208 @@
 
 from .._normflowcore import torch
 
+from functools import partial
+
+try:
+    from ._spline_numba import rqs_eval  # optional; requires numba
+except ImportError:
+    rqs_eval = None
+
+
+def _compile(func):
+    # `torch.compile` fuses the chain of elementwise operations of `func` into
+    # a single kernel; it is available only for torch >= 2.0.
+    # The compiled function is created on the first call (not on import), and
+    # `func` itself is used from then on if `torch.compile` is not supported
+    # on the platform, or if the compilation fails, e.g. because it requires a
+    # C++ compiler on CPU and Triton on GPU, which may not be available.
+    if not hasattr(torch, 'compile'):
+        return func
+    compiled = None
+
+    def wrapper(*args, **kwargs):
+        nonlocal compiled
+        if compiled is None:
+            try:
+                compiled = torch.compile(func, dynamic=True)
+            except Exception:
+                compiled = func
+        try:
+            return compiled(*args, **kwargs)
+        except torch._dynamo.exc.BackendCompilerFailed:
+            compiled = func
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def _specialize(func):
+    # Returns a dispatch table {need_grad: variant of `func`}. The variants
+    # call the same compiled `func`, so that they share the cache of its own
+    # code object; the graphs are specialized on the value of `need_grad`.
+    # (Compiling a common wrapper instead would make all such tables share a
+    # single cache and quickly hit the limit on the number of recompilations.)
+    compiled = _compile(func)
+    variant = lambda need_grad: partial(compiled, need_grad=need_grad)
+    return {False: variant(False), True: variant(True)}
+
+
+def _requires_grad(*tensors):
+    # True if autograd has to track the operations on any of `tensors`
+    return torch.is_grad_enabled() and any(z.requires_grad for z in tensors)
+
+
+# CUDA codes of the rational quadratic function and its derivative for
+# `torch.cuda.jiterator`, which compiles each to a single elementwise kernel
+_RQS_CUDA_CODE = """
+template <typename T> T rqs(T x, T x0, T dx, T y0, T dy, T m, T c, T d0) {
+    T theta = (x - x0) / dx;
+    T inv_denom = 1 / (m + c * theta * (1 - theta));
+    return y0 + dy * theta * (m * theta + d0 * (1 - theta)) * inv_denom;
+}
+"""
+
+_RQS_GRAD_CUDA_CODE = """
+template <typename T> T rqs_grad(T x, T x0, T dx, T y0, T dy, T m, T c, T d0) {
+    T theta = (x - x0) / dx;
+    T inv_denom = 1 / (m + c * theta * (1 - theta));
+    return m * m * (d0 + 2 * (m - d0) * theta + c * theta * theta)
+        * inv_denom * inv_denom;
+}
+"""
+
+
+def _search_segments(x, knots, knots_1d, params):
+    """Return parameters of the segments in which `x` lies, i.e.
+    (x0, dx, y0, dy, m, c, d0), where `dx = x1 - x0`, `dy = y1 - y0`,
+    `m = dy / dx` is the average slope of the segment, and `c = d1 + d0 - 2m`.
+
+    The search is performed on the innermost axis of `knots`, unless
+    `knots_1d` is given, i.e. all rows share the same 1D knots, in which case
+    `torch.bucketize` is used, which requires a cheaper search.
+    The parameters are then fetched from `params`, which is either the tuple
+    of (x, y, d) of knots, from which the end points of the segments are
+    gathered, or the tuple of parameters of all segments precomputed for
+    inference, (x0, dx, y0, dy, m, d0 / m, d1 / m); see
+    `SplineTemplate.inference_params`.
+    """
+    if knots_1d is not None:
+        ind = torch.bucketize(x, knots_1d)
+    else:
+        ind = torch.searchsorted(knots, x)
+    # points outside of knots are assigned to the first and last segments
+    ind = torch.clamp(ind, min=1, max=knots.shape[-1] - 1) - 1
+    # the fields are gathered one by one rather than with a single gather from
+    # a stacked (..., K, 3) tensor: the functions calling this are compiled,
+    # and Inductor fuses these loads into one kernel (the two ways cost the
+    # same, ~0.55 ms for 65536 rows of 12 knots on CPU), while stacking would
+    # copy the knots at each construction (~5.4 ms), which is not amortized
+    # for splines built per call, e.g. in coupling blocks; even in eager mode
+    # the six gathers (1.8 ms) are faster than two stacked ones (2.3 ms)
+    gather = lambda z, i: torch.gather(z, -1, i).to(knots.dtype)
+    if len(params) == 7:  # precomputed parameters of segments
+        x0, dx, y0, dy, m, r0, r1 = [gather(z, ind) for z in params]
+        return x0, dx, y0, dy, m, m * (r0 + r1 - 2), m * r0
+    x0, y0, d0 = [gather(z, ind) for z in params]
+    x1, y1, d1 = [gather(z, ind + 1) for z in params]
+    dx, dy = x1 - x0, y1 - y0
+    m = dy / dx
+    return x0, dx, y0, dy, m, d1 + d0 - 2 * m, d0
+
+
+def _rqs_forward(x, knots, knots_1d, params, need_grad: bool):
+    """Return the rational quadratic function at `x` and (if `need_grad` is
+    True) its derivative.
+
+    All steps, the search for segments, fetching their parameters, and the
+    evaluation, are performed here so that they are compiled together.
+    """
+    x0, dx, y0, dy, m, c, d0 = _search_segments(x, knots, knots_1d, params)
+    theta = (x - x0) / dx
+    theta_sq = theta * theta
+    t1 = theta - theta_sq  # theta (1 - theta), shared by value and derivative
+    inv_denom = 1 / (m + c * t1)
+    y = y0 + dy * (m * theta_sq + d0 * t1) * inv_denom
+    if not need_grad:
+        return y
+    g = m * m * (d0 + 2 * (m - d0) * theta + c * theta_sq) \
+            * inv_denom * inv_denom
+    return y, g
+
+
+def _rqs_inverse(y, knots, knots_1d, params, need_grad: bool):
+    """Return the inverse of the rational quadratic function at `y` and (if
+    `need_grad` is True) its derivative.
+
+    Needs to be checked again to see if works correctly.
+    (The sign of square root depends on details, which might not be
+    specified correctly.)
+    """
+    # Calculate theta from eta, where
+    # eta   = (y - y0) / (y1 - y0) > 0
+    # theta = (x - x0) / (x1 - x0) > 0
+    # and they are related as
+    # (A eta - a) theta^2 + (B eta -b) theta + C eta = 0.
+    x0, dx, y0, dy, m, c, d0 = _search_segments(y, knots, knots_1d, params)
+    eta = (y - y0) / dy
+    a2 = -c * eta + d0 - m
+    a1 = -a2 - m
+    a0 = m * eta
+    # (the in-place operations act on temporaries to reduce the peak memory;
+    # they are safe for autograd because the modified tensors are not saved)
+    delta = a1.mul(a1).sub_(a0.mul(a2).mul_(4)).sqrt_()
+    # conditions:
+    # 1) 0 =< eta =< 1
+    #    0 < m
+    #    0 =< a0
+    # 2) a1**2 = (a2 + m)**2 = a2**2 + m**2 + 2 a2 m >= 4 a2 m
+    #          >= 4 a2 m eta
+    #    therefore ( a1**2 - 4 a2 a0) >= 0
+    #    therefore delta is (positive) real
+    # 3) if a2 >= 0: a1 < 0 and delta < |a1|
+    # 4) if a2 < 0: delta > |a1|
+    # (a2 is replaced by 1 where it vanishes to avoid nan in gradients)
+    a2_safe = torch.where(a2 == 0, torch.ones_like(a2), a2)
+    theta = torch.where(a2 == 0, -a0/a1, (-a1 - delta)/(2 * a2_safe))
+    x = x0 + dx * theta
+    if not need_grad:
+        return x
+    theta_sq = theta * theta
+    denom = m + c * (theta - theta_sq)
+    num = m * m * (d0 + 2 * (m - d0) * theta + c * theta_sq)
+    return x, denom * denom / num
+
+
+def _rls_forward(x, knots, knots_1d, params, need_grad: bool):
+    """Return the rational linear function at `x` and (if `need_grad` is
+    True) its derivative."""
+    x0, dx, y0, dy, m, _, d0 = _search_segments(x, knots, knots_1d, params)
+    theta = (x - x0) / dx
+    inv_denom = 1 / (m + (d0 - m) * theta)
+    y = y0 + dy * d0 * theta * inv_denom
+    if not need_grad:
+        return y
+    return y, m * m * d0 * inv_denom * inv_denom
+
+
+def _rls_inverse(y, knots, knots_1d, params, need_grad: bool):
+    """Return the inverse of the rational linear function at `y` and (if
+    `need_grad` is True) its derivative."""
+    x0, dx, y0, dy, m, _, d0 = _search_segments(y, knots, knots_1d, params)
+    eta = (y - y0) / dy
+    theta = -eta * m / (eta * (d0 - m) - d0)
+    x = x0 + dx * theta
+    if not need_grad:
+        return x
+    denom = m + (d0 - m) * theta
+    return x, denom * denom / (m * m * d0)
+
+
+_RQS_FORWARD = _specialize(_rqs_forward)
+_RQS_INVERSE = _specialize(_rqs_inverse)
+_RLS_FORWARD = _specialize(_rls_forward)
+_RLS_INVERSE = _specialize(_rls_inverse)
+
 
 class SplineTemplate:
     """Interpolate data with a piecewise function.
@@ -38,6 +240,23 @@ class SplineTemplate:
     extrap_right : str, optional
         Similar to `extrap_left`, but for extrapolation to right.
 
+    inference_dtype : torch.dtype, optional
+        If given, e.g. `torch.bfloat16`, the parameters describing the shape
+        of segments (slopes, ...) are calculated in the precision of knots and
+        then are stored in this (lower precision) dtype to reduce the memory
+        traffic of fetching them; see `inference_params`. The fetched values
+        are cast back to the dtype of knots before the evaluation of the
+        spline. (The search for segments and the end points of segments use
+        the knots in the original precision.) The relative errors are at most
+        of the order of the resolution of the dtype, e.g. 4e-3 for bfloat16.
+        WARNING: this is a loss of precision; the derivatives (and hence the
+        log-Jacobians) and the inverse are affected more than the values, and
+        the splines with and without this option are inverses of each other
+        only up to these errors. (The slopes `m` and `c` must not be derived
+        from the rounded knots, which would bend the linear extrapolations.)
+        This option is only for inference and is ignored if autograd tracks
+        any of the knots; training must be performed in full precision.
+
     NOTE: Extrapolation based on first and last intervals can lead to poles.
 
     The number of knots must be at least equal 2.
@@ -45,7 +264,8 @@ class SplineTemplate:
     basically a line.
     """
     def __init__(self, knots_x=None, knots_y=None, knots_d=None, knots_axis=-1,
-            extrapolate=True, extrap_left=None, extrap_right=None
+            extrapolate=True, extrap_left=None, extrap_right=None,
+            inference_dtype=None
             ):
 
         if extrapolate is False:
@@ -54,6 +274,10 @@ class SplineTemplate:
         if knots_x.shape != knots_y.shape:
             raise Exception("x and y must have the same shape.")
 
+        # check if all rows share the same knots, before they get copied
+        shared_x = self.is_shared(knots_x, knots_axis)
+        shared_y = self.is_shared(knots_y, knots_axis)
+
         if knots_d is None:
             knots_d = self.smooth_derivatives(knots_x, knots_y, knots_axis)
 
@@ -64,7 +288,27 @@ class SplineTemplate:
         self.knots_x = knots_x
         self.knots_y = knots_y
         self.knots_d = knots_d
+        # For the evaluation, the knots are also kept (privately) as 2D
+        # tensors with `knots_axis` moved to the innermost axis, on which
+        # `torch.searchsorted` acts (see `_search_segments`), and the other
+        # axes flattened. They are not kept as views of other tensors, because
+        # Dynamo guards on the base of views passed to compiled functions,
+        # which would lead to unnecessary recompilations.
+        self._rows_shape = torch.movedim(knots_x, knots_axis, -1).shape[:-1]
+        self._knots_x = self.to_2d(knots_x, knots_axis)
+        self._knots_y = self.to_2d(knots_y, knots_axis)
+        self._knots_d = self.to_2d(knots_d, knots_axis)
+        # 1D knots shared by all rows (if any) to be used with `torch.bucketize`
+        self._knots_x_1d = self._knots_x[0].clone() if shared_x else None
+        self._knots_y_1d = self._knots_y[0].clone() if shared_y else None
         self.knots_axis = knots_axis
+        # tensors from which the parameters of segments are fetched; see
+        # `_search_segments`
+        knots = (self._knots_x, self._knots_y, self._knots_d)
+        if inference_dtype is not None and not _requires_grad(*knots):
+            self._params = self.inference_params(*knots, inference_dtype)
+        else:
+            self._params = knots
         self.knots_len = knots_x.shape[knots_axis]
         self.segm_len = self.knots_len - 1
         self.shape = knots_x.shape
@@ -98,19 +342,88 @@ class SplineTemplate:
 
             The default value is False.
         """
-        x = x.unsqueeze(self.knots_axis) if squeezed else x
-        segments_ind = self.searchsorted(self.knots_x, x, self.knots_axis)
-        kwargs = dict(squeezed=squeezed, grad=grad)
-        func = self._calc_segment_func(segments_ind, **kwargs)
-        return func(x)
+        x = self._to_inner_axis(x, squeezed)
+        out = self._segment_forward(x, grad=grad)
+        return self._from_inner_axis(out, squeezed)
 
     def backward(self, y, grad=False, squeezed=False):
         """Inverse of the forward method."""
-        y = y.unsqueeze(self.knots_axis) if squeezed else y
-        segments_ind = self.searchsorted(self.knots_y, y, self.knots_axis)
-        kwargs = dict(squeezed=squeezed, grad=grad)
-        inv_func = self._calc_segment_inv_func(segments_ind, **kwargs)
-        return inv_func(y)
+        y = self._to_inner_axis(y, squeezed)
+        out = self._segment_backward(y, grad=grad)
+        return self._from_inner_axis(out, squeezed)
+
+    def _to_inner_axis(self, x, squeezed=False):
+        # moves (or inserts if squeezed) the axis of knots to the innermost one
+        if squeezed:
+            return x.unsqueeze(-1)
+        return torch.movedim(x, self.knots_axis, -1)
+
+    def _from_inner_axis(self, out, squeezed=False):
+        # reverts `_to_inner_axis` for `out`, which can be a tuple of tensors
+        if squeezed:
+            revert = lambda z: z.squeeze(-1)
+        else:
+            revert = lambda z: torch.movedim(z, -1, self.knots_axis)
+        if isinstance(out, tuple):
+            return tuple(revert(z) for z in out)
+        return revert(out)
+
+    def _call_2d(self, func, x, knots, knots_1d):
+        # calls `func` with `x` reshaped to a 2D tensor (keeping the innermost
+        # axis) like the knots, so that the compiled `func` is always called
+        # with tensors of the same rank and layout, and reshapes the output
+        x_2d = x.reshape(-1, x.shape[-1]).contiguous()
+        out = func(x_2d, knots, knots_1d, self._params)
+        if isinstance(out, tuple):
+            return tuple(z.reshape(x.shape) for z in out)
+        return out.reshape(x.shape)
+
+    @staticmethod
+    def to_2d(z, knots_axis):
+        """Return `z` with `knots_axis` moved to the innermost axis and the
+        other axes flattened, as a contiguous tensor that is not a view.
+        """
+        if knots_axis % z.dim() != z.dim() - 1:
+            z = torch.movedim(z, knots_axis, -1)
+        if z.dim() != 2:
+            z = z.reshape(-1, z.shape[-1])
+        if z._base is not None:
+            return z.clone(memory_format=torch.contiguous_format)
+        return z.contiguous()
+
+    @staticmethod
+    def inference_params(knots_x, knots_y, knots_d, dtype):
+        """Return parameters of all segments, where the knots are placed along
+        the innermost axis, for `_search_segments`; they are calculated in the
+        precision of knots and only those describing the shape of segments,
+        i.e. `m`, `d0 / m` and `d1 / m`, are stored in `dtype`. The starting
+        points and the widths and heights of segments are kept in the
+        precision of knots, because their rounding errors would be
+        proportional to the size of segments, which can be large, e.g. for
+        extrapolation. The ratios are stored instead of `d0` and `c` so that
+        their rounding errors are relative to the derivatives at the knots and
+        not to `m`; moreover, for linear (e.g. extrapolation) segments the
+        ratios are 1 up to the rounding errors of knots, which are lost in the
+        cast, hence `c` vanishes and such segments remain linear.
+        """
+        cast = lambda z: z.to(dtype).contiguous()
+        x0, y0, d0 = [z[:, :-1] for z in (knots_x, knots_y, knots_d)]
+        dx = (knots_x[:, 1:] - x0).contiguous()
+        dy = (knots_y[:, 1:] - y0).contiguous()
+        m = dy / dx
+        d1 = knots_d[:, 1:]
+        return knots_x, dx, knots_y, dy, cast(m), cast(d0 / m), cast(d1 / m)
+
+    @staticmethod
+    def is_shared(knots, knots_axis):
+        """Return True if `knots` is broadcasted from a 1D tensor along
+        `knots_axis`, i.e. if all rows share the same knots.
+        """
+        axis = knots_axis % knots.dim()
+        shape, stride = knots.shape, knots.stride()
+        return all(shape[k] == 1 or stride[k] == 0
+                for k in range(knots.dim()) if k != axis
+                )
 
     @staticmethod
     def smooth_derivatives(knots_x, knots_y, knots_axis, bc_type='not-ones'):
@@ -119,38 +432,27 @@ class SplineTemplate:
         of the nearby segment if `bc_type` is not 'ones', otherwise returns 1.
         """
         # Note that for n knots there are only n-1 segments
-        knots_len = knots_x.shape[knots_axis]
-        knot_ind = torch.tensor(range(knots_len))
-        segm_ind = torch.tensor(range(knots_len - 1))
-        select = lambda z, ind: torch.index_select(z, knots_axis, ind)
-        diff_select = lambda z, ind: select(z, ind[1:]) - select(z, ind[:-1])
-        sum_select = lambda z, ind: select(z, ind[1:]) + select(z, ind[:-1])
+        # (narrow returns views, hence no copies are made for the selections)
+        select_range = lambda z, start, stop: \
+                z.narrow(knots_axis, start, stop - start)
+        head = lambda z: select_range(z, 0, z.shape[knots_axis] - 1)
+        tail = lambda z: select_range(z, 1, z.shape[knots_axis])
+        diff_select = lambda z: tail(z) - head(z)
+        sum_select = lambda z: tail(z) + head(z)
 
         # m is used to denote the slope of segments
-        m = diff_select(knots_y, knot_ind) / diff_select(knots_x, knot_ind)
-        m_avg = 0.5 * sum_select(m, segm_ind)
+        m = diff_select(knots_y) / diff_select(knots_x)
+        m_avg = 0.5 * sum_select(m)
 
+        segm_len = m.shape[knots_axis]
         if bc_type == 'ones':
-            ones = torch.ones_like(select(m, segm_ind[0]))
+            ones = torch.ones_like(select_range(m, 0, 1))
             m_left, m_right = ones, ones
         else:
-            m_left = select(m, segm_ind[0])
-            m_right = select(m, segm_ind[-1])
+            m_left = select_range(m, 0, 1)
+            m_right = select_range(m, segm_len - 1, segm_len)
         return torch.cat((m_left, m_avg, m_right), knots_axis)
 
-    @staticmethod
-    def searchsorted(x_sorted, x, axis):
-        """The same `torch.searchsorted` except that the search can be done on
-        any axis. (`torch.searchsorted` acts on the innermost dimension.)
-        """
-        if (axis == -1) or (axis == x.dim()-1):
-            return torch.searchsorted(x_sorted, x)
-        else:
-            view_x_sorted = torch.movedim(x_sorted, axis, -1)
-            view_x = torch.movedim(x, axis, -1)
-            view_ind = torch.searchsorted(view_x_sorted, view_x)
-            return torch.movedim(view_ind, -1, axis)
-
 
 class Pade22Spline(SplineTemplate):
     """Rational quadratic, i.e. Pade [2, 2], spline data interpolator.
@@ -162,100 +464,74 @@ class Pade22Spline(SplineTemplate):
     can be free parameters only at two knots.
     """
 
-    def _calc_segment_func(self, segm_ind, squeezed=False, grad=False):
-        """Elements of segm_ind must be in range(self.segm_len + 2)."""
-
-        axis = self.knots_axis
-        segm_ind = torch.clamp(segm_ind, min=1, max=self.segm_len) - 1
-        gather = lambda z, i: torch.gather(z, axis, segm_ind + i)
-
-        x0 = gather(self.knots_x, 0)
-        x1 = gather(self.knots_x, 1)
-        y0 = gather(self.knots_y, 0)
-        y1 = gather(self.knots_y, 1)
-        d0 = gather(self.knots_d, 0)
-        d1 = gather(self.knots_d, 1)
-        m = (y1 - y0)/(x1 - x0)  # average slope of each segment
+    _jit_funcs = None  # (rqs, rqs_grad) compiled by jiterator; see below
 
-        squeezer = lambda y: y.squeeze(axis) if squeezed else y
-
-        def g_0(theta):
-            return y0 + (y1 - y0) * theta * (m * theta + d0 * (1 - theta)) \
-                     / (m + (d1 + d0 - 2*m) * theta * (1 - theta))
-
-        def g_1(theta):
-            return m**2 * (d0 + 2 * (m - d0) * theta + (d1+d0-2*m) * theta**2) \
-                     / (m + (d1 + d0 - 2*m) * theta * (1 - theta))**2
+    @classmethod
+    def _jit_forward(cls, x, x0, dx, y0, dy, m, c, d0, grad=False):
+        """Evaluate the spline with kernels generated by `torch.cuda.jiterator`,
+        which do not support autograd; `x` must be on a cuda device.
+        """
+        if cls._jit_funcs is None:
+            create_jit_fn = torch.cuda.jiterator._create_jit_fn
+            cls._jit_funcs = (create_jit_fn(_RQS_CUDA_CODE),
+                              create_jit_fn(_RQS_GRAD_CUDA_CODE)
+                              )
+        rqs, rqs_grad = cls._jit_funcs
+        y = rqs(x, x0, dx, y0, dy, m, c, d0)
+        return (y, rqs_grad(x, x0, dx, y0, dy, m, c, d0)) if grad else y
 
-        def func(x):
-            theta = (x - x0)/(x1 - x0)
-            if grad:
-                return squeezer(g_0(theta)), squeezer(g_1(theta))
-            else:
-                return squeezer(g_0(theta))
+    def forward(self, x, grad=False, squeezed=False):
+        """Similar to `SplineTemplate.forward`, but if numba is installed and
+        no gradients need to be tracked by autograd (e.g. in sampling), on CPU
+        uses a compiled kernel that fuses all steps in one parallel loop.
+        """
+        x_ = self._to_inner_axis(x, squeezed)
+        if self._numba_applicable(x_):
+            out = self._numba_forward(x_, grad=grad)
+            return self._from_inner_axis(out, squeezed)
+        return super().forward(x, grad=grad, squeezed=squeezed)
+
+    def _numba_applicable(self, x):
+        # `x` is assumed to have the axis of knots as its innermost axis
+        knots = (self._knots_x, self._knots_y, self._knots_d)
+        if rqs_eval is None or x.device.type != 'cpu':
+            return False
+        if _requires_grad(x, *knots):
+            return False
+        # numba supports neither bfloat16 nor float16; also, the kernel uses
+        # the knots in their original precision, hence it is not used if
+        # `inference_dtype` is set, i.e. if parameters of segments are stored
+        if x.dtype not in (torch.float32, torch.float64) \
+                or len(self._params) != 3:
+            return False
+        return x.shape[:-1] == self._rows_shape \
+                and all(z.dtype == x.dtype for z in knots)
+
+    def _numba_forward(self, x, grad=False):
+        # `x` is assumed to have the axis of knots as its innermost axis
+        x_2d = x.reshape(-1, x.shape[-1]).contiguous()
+        y, dy = torch.empty_like(x_2d), torch.empty_like(x_2d)
+        kx, ky, kd = self._knots_x, self._knots_y, self._knots_d
+        rqs_eval(x_2d.numpy(), kx.numpy(), ky.numpy(), kd.numpy(),
+                y.numpy(), dy.numpy()
+                )
+        if grad:
+            return y.reshape(x.shape), dy.reshape(x.shape)
+        else:
+            return y.reshape(x.shape)
 
-        return func
+    def _segment_forward(self, x, grad=False):
+        args = (self._knots_x, self._knots_x_1d)
+        if x.is_cuda and not _requires_grad(x, *self._params):
+            func = lambda x, *args: \
+                    self._jit_forward(x, *_search_segments(x, *args), grad=grad)
+        else:
+            func = _RQS_FORWARD[grad]
+        return self._call_2d(func, x, *args)
 
-    def _calc_segment_inv_func(self, segm_ind, squeezed=False, grad=False):
-        """Needs to be checked again to see if works correctly.
-        (The sign of square root depends on details, which might not be
-        specified correctly.)
-        Elements of segm_ind must be in range(self.segm_len + 2)."""
-
-        axis = self.knots_axis
-        segm_ind = torch.clamp(segm_ind, min=1, max=self.segm_len) - 1
-        gather = lambda z, i: torch.gather(z, axis, segm_ind + i)
-
-        x0 = gather(self.knots_x, 0)
-        x1 = gather(self.knots_x, 1)
-        y0 = gather(self.knots_y, 0)
-        y1 = gather(self.knots_y, 1)
-        d0 = gather(self.knots_d, 0)
-        d1 = gather(self.knots_d, 1)
-        m = (y1 - y0)/(x1 - x0)  # average slope of each segment
-
-        squeezer = lambda y: y.squeeze(axis) if squeezed else y
-
-        def calc_theta(eta):
-            """Calculate theta from eta, where
-            eta   = (y - y0) / (y1 - y0) > 0
-            theta = (x - x0) / (x1 - x0) > 0
-            and they are related as
-            (A eta - a) theta^2 + (B eta -b) theta + C eta = 0.
-            """
-            a2 = (2*m - d1 - d0) * eta + d0 - m
-            a1 = -a2 - m
-            a0 = m * eta
-            delta = torch.sqrt(a1**2 - 4 * a0 * a2)
-            theta = torch.empty(eta.shape)
-            # conditions:
-            # 1) 0 =< eta =< 1
-            #    0 < m
-            #    0 =< a0 
-            # 2) a1**2 = (a2 + m)**2 = a2**2 + m**2 + 2 a2 m >= 4 a2 m
-            #          >= 4 a2 m eta
-            #    therefore ( a1**2 - 4 a2 a0) >= 0
-            #    therefore delta is (positive) real
-            # 3) if a2 >= 0: a1 < 0 and delta < |a1|
-            # 4) if a2 < 0: delta > |a1|
-            theta [a2 == 0] = (-a0/a1) [a2 == 0]
-            theta [a2 != 0] = ((-a1 - delta)/(2 * a2)) [a2 != 0]
-            return theta
-
-        def g_1(theta):
-            return m**2 * (d0 + 2 * (m - d0) * theta + (d1+d0-2*m) * theta**2) \
-                     / (m + (d1 + d0 - 2*m) * theta * (1 - theta))**2
-
-        def inv_func(y):
-            eta = (y - y0)/(y1 - y0)
-            theta = calc_theta(eta)
-            x = x0 + (x1 - x0) * theta
-            if grad:
-                return squeezer(x), squeezer(1/g_1(theta))
-            else:
-                return squeezer(x)
-
-        return inv_func
+    def _segment_backward(self, y, grad=False):
+        args = (self._knots_y, self._knots_y_1d)
+        return self._call_2d(_RQS_INVERSE[grad], y, *args)
 
 
 class Pade11Spline(SplineTemplate):
@@ -268,12 +544,15 @@ class Pade11Spline(SplineTemplate):
     def smooth_derivatives(knots_x, knots_y, knots_axis, bc_type='natural'):
 
         knots_len = knots_x.shape[knots_axis]
-        knot_ind = torch.tensor(range(knots_len))
-        segm_ind = torch.tensor(range(knots_len - 1))
+        knot_ind = torch.arange(knots_len, device=knots_x.device)
+        segm_ind = knot_ind[:-1]
         select = lambda z, ind: torch.index_select(z, knots_axis, ind)
-        diff_select = lambda z, ind: select(z, ind[1:]) - select(z, ind[:-1])
+        select_range = lambda z, start, stop: \
+                z.narrow(knots_axis, start, stop - start)
+        diff_select = lambda z: \
+                select_range(z, 1, knots_len) - select_range(z, 0, knots_len - 1)
 
-        m = diff_select(knots_y, knot_ind) / diff_select(knots_x, knot_ind)
+        m = diff_select(knots_y) / diff_select(knots_x)
 
         if bc_type == 'natural':
             n = 2 * ((knots_len-1)//2)  # segm_len = knots_len - 1
@@ -282,71 +561,22 @@ class Pade11Spline(SplineTemplate):
                 ).unsqueeze(knots_axis) * 0 + 1
         else:
             raise Exception("bc_type is not know")
-        d_list = [d0]
-        for k in range(knots_len - 1):
-            d_list.append(select(m, knot_ind[k])**2 / d_list[-1])
-        return torch.cat(tuple(d_list), knots_axis) 
-
-    def _calc_segment_func(self, segm_ind, squeezed=False, grad=False):
-        """Elements of segm_ind must be in range(self.segm_len + 2)."""
-
-        axis = self.knots_axis
-        segm_ind = torch.clamp(segm_ind, min=1, max=self.segm_len) - 1
-        gather = lambda z, i: torch.gather(z, axis, segm_ind + i)
-
-        x0 = gather(self.knots_x, 0)
-        x1 = gather(self.knots_x, 1)
-        y0 = gather(self.knots_y, 0)
-        y1 = gather(self.knots_y, 1)
-        d0 = gather(self.knots_d, 0)
-        m = (y1 - y0)/(x1 - x0)  # average slope of each segment
-
-        squeezer = lambda y: y.squeeze(axis) if squeezed else y
-
-        def g_0(theta):
-            return y0 + (y1 - y0) * d0 * theta / (m + (d0 - m) * theta)
-
-        def g_1(theta):
-            return m**2 * d0 / (m + (d0 - m) * theta)**2
-
-        def func(x):
-            theta = (x - x0)/(x1 - x0)
-            if grad:
-                return squeezer(g_0(theta)), squeezer(g_1(theta))
-            else:
-                return squeezer(g_0(theta))
-
-        return func
-
-    def _calc_segment_inv_func(self, segm_ind, squeezed=False, grad=False):
-        """Elements of segm_ind must be in range(self.segm_len + 2)."""
-
-        axis = self.knots_axis
-        segm_ind = torch.clamp(segm_ind, min=1, max=self.segm_len) - 1
-        gather = lambda z, i: torch.gather(z, axis, segm_ind + i)
-
-        x0 = gather(self.knots_x, 0)
-        x1 = gather(self.knots_x, 1)
-        y0 = gather(self.knots_y, 0)
-        y1 = gather(self.knots_y, 1)
-        d0 = gather(self.knots_d, 0)
-        m = (y1 - y0)/(x1 - x0)  # average slope of each segment
+        # The recursion d_{k+1} = m_k^2 / d_k is solved in closed form as
+        # d_{k+1} = (d_0 prod_{i<=k} m_i^{-2 sign_i})^{-sign_k},
+        # where sign_i = (-1)^i.
+        shape = [1] * m.dim()
+        shape[knots_axis] = knots_len - 1
+        sign = (1 - 2 * (segm_ind % 2)).reshape(shape)
+        d = (d0 * torch.cumprod(m**(-2 * sign), dim=knots_axis))**(-sign)
+        return torch.cat((d0, d), knots_axis)
 
-        squeezer = lambda y: y.squeeze(axis) if squeezed else y
+    def _segment_forward(self, x, grad=False):
+        args = (self._knots_x, self._knots_x_1d)
+        return self._call_2d(_RLS_FORWARD[grad], x, *args)
 
-        def g_1(theta):
-            return m**2 * d0 / (m + (d0 - m) * theta)**2
-
-        def inv_func(y):
-            eta = (y - y0)/(y1 - y0)
-            theta = -eta * m / (eta * (d0 - m) - d0)
-            x = x0 + (x1 - x0) * theta
-            if grad:
-                return squeezer(x), squeezer(1/g_1(theta))
-            else:
-                return squeezer(x)
-
-        return inv_func
+    def _segment_backward(self, y, grad=False):
+        args = (self._knots_y, self._knots_y_1d)
+        return self._call_2d(_RLS_INVERSE[grad], y, *args)
 
 
 RQSpline = Pade22Spline  # alias: Rational Quadratic Spline
@@ -380,8 +610,8 @@ class AugmentKnots:
         x, y, d, axis = self.knots_x, self.knots_y, self.knots_d, self.knots_axis
         n = x.shape[axis]
 
-        select_0 = lambda z: torch.index_select(z, axis, torch.tensor([0]))
-        select_1 = lambda z: torch.index_select(z, axis, torch.tensor([n-1]))
+        select_0 = lambda z: z.narrow(axis, 0, 1)
+        select_1 = lambda z: z.narrow(axis, n-1, 1)
 
         if left == "linear":
             x_fiducial_left = select_0(x) - 1
@@ -409,39 +639,39 @@ class AugmentKnots:
         x, y, d, axis = self.knots_x, self.knots_y, self.knots_d, self.knots_axis
         n = x.shape[axis]
 
-        knot_ind = torch.tensor(range(n))
-        select_0 = lambda z: torch.index_select(z, axis, knot_ind[:1])
-        select_1 = lambda z: torch.index_select(z, axis, knot_ind[-1:])
-        select = lambda z, ind: torch.index_select(z, axis, ind)
-        selectflip = lambda z, ind: torch.flip(select(z, ind), [axis])
+        select_0 = lambda z: z.narrow(axis, 0, 1)
+        select_1 = lambda z: z.narrow(axis, n-1, 1)
+        # all knots except the first (last) one in reversed order
+        flip_0 = lambda z: z.narrow(axis, 1, n-1).flip(axis)
+        flip_1 = lambda z: z.narrow(axis, 0, n-1).flip(axis)
 
         if left in ["anti", "anti-periodic"]:
-            x_fiducial_left = 2 * select_0(x) - selectflip(x, knot_ind[1:])
-            y_fiducial_left = 2 * select_0(y) - selectflip(y, knot_ind[1:])
-            d_fiducial_left = selectflip(d, knot_ind[1:])
+            x_fiducial_left = 2 * select_0(x) - flip_0(x)
+            y_fiducial_left = 2 * select_0(y) - flip_0(y)
+            d_fiducial_left = flip_0(d)
         elif left == "periodic":
             # first check if derivative @ boundary is zero
-            if not sum(torch.index_select(d, axis, knot_ind[:1]) == 0):
+            if not torch.all(select_0(d) == 0):
                 raise Exception("Oops: derivative at periodic bc must be zero.")
-            x_fiducial_left = 2 * select_0(x) - selectflip(x, knot_ind[1:])
-            y_fiducial_left = selectflip(y, knot_ind[1:])
-            d_fiducial_left = - selectflip(d, knot_ind[1:])
+            x_fiducial_left = 2 * select_0(x) - flip_0(x)
+            y_fiducial_left = flip_0(y)
+            d_fiducial_left = - flip_0(d)
         else:
             x_fiducial_left = None
             y_fiducial_left = None
             d_fiducial_left = None
 
         if right in ["anti", "anti-periodic"]:
-            x_fiducial_right = 2 * select_1(x) - selectflip(x, knot_ind[:-1])
-            y_fiducial_right = 2 * select_1(y) - selectflip(y, knot_ind[:-1])
-            d_fiducial_right = selectflip(d, knot_ind[:-1])
+            x_fiducial_right = 2 * select_1(x) - flip_1(x)
+            y_fiducial_right = 2 * select_1(y) - flip_1(y)
+            d_fiducial_right = flip_1(d)
         elif right == "periodic":
             # first check if derivative @ boundary is zero
-            if not sum(torch.index_select(d, axis, knot_ind[-1:]) == 0):
+            if not torch.all(select_1(d) == 0):
                 raise Exception("Oops: derivative at periodic bc must be zero.")
-            x_fiducial_right = 2 * select_1(x) - selectflip(x, knot_ind[:-1])
-            y_fiducial_right = selectflip(y, knot_ind[:-1])
-            d_fiducial_right = - selectflip(d, knot_ind[:-1])
+            x_fiducial_right = 2 * select_1(x) - flip_1(x)
+            y_fiducial_right = flip_1(y)
+            d_fiducial_right = - flip_1(d)
         else:
             x_fiducial_right = None
             y_fiducial_right = None
@@ -491,3 +721,120 @@ def test_pade22(knots_len=4, test_pade11=False, smooth=True, **kwargs):
     plt.show()
 
     return spline
+
+
+def test_pade11_derivatives(max_knots_len=40, knots_axis=-1):
+    """Compare the derivatives obtained by `Pade11Spline.smooth_derivatives`
+    in closed form with the ones obtained by an explicit loop over the
+    recursion `d_{k+1} = m_k^2 / d_k`, starting from `d_0 = 1`.
+    """
+    kwargs = dict(dtype=torch.float64)
+    for knots_len in range(2, max_knots_len + 1):
+        knots_x = torch.cumsum(torch.rand((5, knots_len), **kwargs) + 0.1, -1)
+        knots_y = torch.cumsum(torch.rand((5, knots_len), **kwargs) + 0.1, -1)
+        diff = lambda z: z[:, 1:] - z[:, :-1]
+        m = diff(knots_y) / diff(knots_x)
+        d = [torch.ones_like(m[:, :1])]
+        for k in range(knots_len - 1):
+            d.append(m[:, k:k+1]**2 / d[-1])
+        d = torch.cat(d, -1)
+
+        if knots_axis == 0:
+            knots_x, knots_y, d = knots_x.T, knots_y.T, d.T
+        d_closed = Pade11Spline.smooth_derivatives(knots_x, knots_y, knots_axis)
+        error = torch.max(torch.abs(d_closed / d - 1)).item()
+        if error > 1e-10:
+            raise Exception(f"Oops: mismatch of {error} for {knots_len} knots")
+
+
+def test_pade22_paths(rows=5, knots_len=6, tol=1e-10):
+    """Compare the alternative paths of evaluation of `Pade22Spline`, i.e.
+    the numba kernel on CPU, the jiterator kernels on GPU, and the search with
+    `torch.bucketize` for shared knots, with the plain (not compiled) functions.
+    The numba and jiterator paths are skipped if numba or CUDA is not available.
+    """
+    kwargs = dict(dtype=torch.float64)
+    knots_x = torch.cumsum(torch.rand((rows, knots_len), **kwargs) + 0.1, -1)
+    knots_y = torch.cumsum(torch.rand((rows, knots_len), **kwargs) + 0.1, -1)
+    knots_d = torch.rand((rows, knots_len), **kwargs) + 0.1
+    x = torch.rand((rows, 100), **kwargs) * (knots_len + 2) - 1
+    spline_kwargs = dict(extrap_left='anti', extrap_right='linear')
+
+    def compare(out, expected, label):
+        close = lambda a, b: torch.allclose(a, b, atol=tol, equal_nan=True)
+        if not all(close(a, b) for a, b in zip(out, expected)):
+            raise Exception(f"Oops: {label} deviates from the plain function")
+
+    spline = Pade22Spline(knots_x, knots_y, knots_d, **spline_kwargs)
+    args = (spline._knots_x, spline._knots_x_1d, spline._params)
+    expected = _rqs_forward(x, *args, need_grad=True)
+
+    with torch.no_grad():
+        if rqs_eval is not None:
+            compare(spline._numba_forward(x, grad=True), expected, 'numba')
+
+        if torch.cuda.is_available():
+            cuda = lambda z: None if z is None else z.to('cuda')
+            x_cuda = cuda(x)
+            segments = _search_segments(x_cuda, cuda(args[0]), cuda(args[1]),
+                    tuple(cuda(z) for z in args[2])
+                    )
+            out = Pade22Spline._jit_forward(x_cuda, *segments, grad=True)
+            compare([z.to('cpu') for z in out], expected, 'jiterator')
+
+    # all rows share the same knots, hence `torch.bucketize` is used
+    shared = lambda z: z[0].expand(rows, -1)
+    spline = Pade22Spline(shared(knots_x), shared(knots_y), shared(knots_d),
+            **spline_kwargs
+            )
+    if spline._knots_x_1d is None or spline._knots_y_1d is None:
+        raise Exception("Oops: shared knots are not detected")
+    for func, knots, knots_1d in [
+            (_rqs_forward, spline._knots_x, spline._knots_x_1d),
+            (_rqs_inverse, spline._knots_y, spline._knots_y_1d)
+            ]:
+        out = func(x, knots, knots_1d, spline._params, need_grad=True)
+        expected = func(x, knots, None, spline._params, need_grad=True)
+        compare(out, expected, 'bucketize')
+
+
+def test_inference_dtype(rows=5, knots_len=6, inference_dtype=torch.bfloat16,
+        tol=1e-2
+        ):
+    """Bound the errors of `Pade22Spline` with `inference_dtype` relative to
+    the one in the precision of knots (float32), for inputs in the range of
+    knots and for inputs extrapolated linearly; the relative errors of values
+    must be smaller than `tol`, and of derivatives and of the inverse map
+    (in the range of knots), which are more sensitive, smaller than `10 tol`.
+    """
+    # (uneven knots, which lead to steep segments and long extrapolations)
+    knots_x = torch.cumsum(torch.rand((rows, knots_len))**4 + 1e-3, -1)
+    knots_y = torch.cumsum(torch.rand((rows, knots_len)), -1)
+    knots_d = torch.rand((rows, knots_len)) + 0.1
+    spline_kwargs = dict(extrap_left='linear', extrap_right='linear')
+    spline = Pade22Spline(knots_x, knots_y, knots_d, **spline_kwargs)
+    spline_ = Pade22Spline(knots_x, knots_y, knots_d, **spline_kwargs,
+            inference_dtype=inference_dtype
+            )
+
+    def compare(out, expected, tol, label):
+        error = torch.max(torch.abs(out - expected) / (1 + torch.abs(expected)))
+        if not error <= tol:
+            raise Exception(f"Oops: {label} deviates by {error.item()}")
+
+    first, last = knots_x[:, :1], knots_x[:, -1:]
+    x_in = first + torch.rand((rows, 100)) * (last - first)
+    x_out = torch.cat((first - 3 * torch.rand((rows, 50)),
+                       last + 3 * torch.rand((rows, 50))), -1)
+    with torch.no_grad():
+        for x, label in [(x_in, 'in range'), (x_out, 'extrapolated')]:
+            y, g = spline(x, grad=True)
+            y_, g_ = spline_(x, grad=True)
+            compare(y_, y, tol, f"value {label}")
+            compare(g_, g, 10 * tol, f"derivative {label}")
+        # (only where the inverse is accurate in full precision; see the note
+        # in the docstring of `_rqs_inverse`)
+        y = spline(x_in)
+        x, x_ = spline.backward(y), spline_.backward(y)
+        valid = torch.abs(x - x_in) < 1e-4 * (1 + torch.abs(x_in))
+        compare(x_[valid], x[valid], 10 * tol, 'inverse')